@@ -83,12 +83,58 @@ class Pose3DEstimator:
         Returns:
             tuple: (all_people_poses_3d, metadata)
         """
-        print(f"\n🚀 Starting 3D pose estimation pipeline...")
-        start_time = time.time()
-        
         # Load và validate 2D poses
         poses_2d_data = self._load_and_validate_2d_poses(poses_2d_file)
         
+        return self._process_2d_poses_data(
+            poses_2d_data, poses_2d_file, output_prefix, enable_filtering, enable_smoothing
+        )
+    
+    def process_2d_poses_array(self, poses_2d, width, height, fps=30.0, output_prefix="output_3d",
+                               enable_filtering=True, enable_smoothing=False):
+        """
+        Xử lý 2D poses trong bộ nhớ (không cần ghi/đọc lại file JSON)
+        
+        Args:
+            poses_2d: frames -> people -> keypoints -> [x, y, confidence], dạng
+                      np.ndarray (frames, people, keypoints, 3) hoặc nested list
+                      như all_poses trả về từ PoseDetector.detect_poses_from_video
+            width, height: Kích thước video (pixels)
+            fps: FPS của poses
+            output_prefix: Prefix cho output files
+            enable_filtering: Có filter low-quality poses không
+            enable_smoothing: Có apply temporal smoothing không
+            
+        Returns:
+            tuple: (all_people_poses_3d, metadata)
+        """
+        if isinstance(poses_2d, np.ndarray):
+            # Pipeline xử lý theo frame/người (số người mỗi frame có thể khác nhau)
+            poses_2d = poses_2d.tolist()
+        
+        if len(poses_2d) == 0:
+            raise ValueError("Invalid or empty poses data")
+        
+        poses_2d_data = {
+            'poses': poses_2d,
+            'video_info': {
+                'width': width,
+                'height': height,
+                'fps': fps,
+                'total_frames': len(poses_2d)
+            }
+        }
+        
+        return self._process_2d_poses_data(
+            poses_2d_data, "<in-memory poses>", output_prefix, enable_filtering, enable_smoothing
+        )
+    
+    def _process_2d_poses_data(self, poses_2d_data, poses_2d_file, output_prefix,
+                               enable_filtering, enable_smoothing):
+        """Pipeline chung cho 2D poses đã load (từ file hoặc từ bộ nhớ)"""
+        print(f"\n🚀 Starting 3D pose estimation pipeline...")
+        start_time = time.time()
+        
         poses_2d = poses_2d_data['poses']
         width = poses_2d_data['video_info']['width']
         height = poses_2d_data['video_info']['height']
@@ -163,7 +209,7 @@ class Pose3DEstimator:
     
     def _analyze_people_structure(self, poses_2d):
         """Phân tích cấu trúc multi-person trong data"""
-        max_people = max(len(frame) for frame in poses_2d) if poses_2d else 0
+        max_people = max(len(frame) for frame in poses_2d) if len(poses_2d) else 0
         
         people_analysis = []
         
@@ -192,7 +238,7 @@ class Pose3DEstimator:
                 'person_id': person_idx,
                 'total_appearances': appearances,
                 'valid_frames': valid_frames,
-                'appearance_rate': appearances / len(poses_2d) if poses_2d else 0,
+                'appearance_rate': appearances / len(poses_2d) if len(poses_2d) else 0,
                 'valid_rate': valid_frames / appearances if appearances > 0 else 0,
                 'avg_quality': np.mean(quality_scores) if quality_scores else 0,
                 'processable': valid_frames >= self.min_frames_threshold
@@ -1,139 +1,630 @@
 import cv2
 import numpy as np
 import mediapipe as mp
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from types import SimpleNamespace
 
-class PoseComparison:
-    def __init__(self, reference_video_path):
-        # Initialize MediaPipe
+# Let FFmpeg decode/encode with all cores. These are process-wide environment defaults
+# set at import time, so they apply to every FFmpeg capture/writer opened afterwards,
+# including ones opened by code that merely imports this module (set the variables
+# beforehand to override). Frame threading adds roughly one frame of decode latency
+# per thread; the live camera is unaffected only because it doesn't use FFmpeg.
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "threads;0|thread_type;frame+slice")
+os.environ.setdefault("OPENCV_FFMPEG_WRITER_OPTIONS", "threads;0")
+
+def _open_video(path):
+    """
+    Open a video file, with hardware-accelerated decoding if available
+    
+    VIDEO_ACCELERATION_ANY picks VAAPI/D3D11/NVDEC-backed FFmpeg decoding when
+    present and software decoding otherwise. If FFmpeg can't open the file (or
+    rejects the acceleration parameters), OpenCV's default backend is used.
+    """
+    try:
+        cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG,
+                               [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    except cv2.error:
+        pass
+    return cv2.VideoCapture(path)
+
+# Optional Numba JIT for the per-frame scoring kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+def _limb_score_kernel(pose1, pose2, connections, threshold, wrong_mask):
+    """
+    Fused limb cosine similarity + threshold over flattened (x, y) poses
+    
+    Marks both endpoints of every limb below threshold in wrong_mask and
+    returns the number of correct keypoints.
+    """
+    for e in range(connections.shape[0]):
+        a = connections[e, 0]
+        b = connections[e, 1]
+        x1 = pose1[2 * b] - pose1[2 * a]
+        y1 = pose1[2 * b + 1] - pose1[2 * a + 1]
+        x2 = pose2[2 * b] - pose2[2 * a]
+        y2 = pose2[2 * b + 1] - pose2[2 * a + 1]
+        
+        norms = np.sqrt(x1 * x1 + y1 * y1) * np.sqrt(x2 * x2 + y2 * y2)
+        if (x1 * x2 + y1 * y2) / (norms + 1e-10) < threshold:
+            wrong_mask[a] = True
+            wrong_mask[b] = True
+    
+    num_correct = 0
+    for i in range(wrong_mask.shape[0]):
+        if not wrong_mask[i]:
+            num_correct += 1
+    return num_correct
+
+if NUMBA_AVAILABLE:
+    _limb_score_kernel = njit(cache=True, fastmath=True)(_limb_score_kernel)
+
+class TaskPose:
+    """
+    MediaPipe Tasks PoseLandmarker behind the same process()/close() interface as mp.solutions.pose.Pose
+    
+    Lets a custom .task model (e.g. the lite or an int8-quantized BlazePose
+    landmarker) run on the XNNPACK CPU delegate, or on the GPU delegate when
+    use_gpu is set and the platform supports it.
+    """
+    def __init__(self, model_asset_path, fps=30.0, use_gpu=False):
+        from mediapipe.tasks import python as mp_tasks
+        from mediapipe.tasks.python import vision
+        
+        delegates = [mp_tasks.BaseOptions.Delegate.CPU]
+        if use_gpu:
+            delegates.insert(0, mp_tasks.BaseOptions.Delegate.GPU)
+        
+        for delegate in delegates:
+            options = vision.PoseLandmarkerOptions(
+                base_options=mp_tasks.BaseOptions(
+                    model_asset_path=model_asset_path,
+                    delegate=delegate
+                ),
+                running_mode=vision.RunningMode.VIDEO,
+                num_poses=1,
+                min_pose_detection_confidence=0.5,
+                min_tracking_confidence=0.5
+            )
+            try:
+                self.landmarker = vision.PoseLandmarker.create_from_options(options)
+                break
+            except (RuntimeError, NotImplementedError) as e:
+                # Only the GPU attempt may fail over; CPU errors (e.g. a bad model path) propagate
+                if delegate == mp_tasks.BaseOptions.Delegate.CPU:
+                    raise
+                print(f"⚠️ GPU delegate unavailable ({e}), using CPU")
+        
+        # VIDEO mode needs strictly increasing timestamps
+        self.frame_interval_ms = max(1, int(1000 / fps))
+        self.timestamp_ms = 0
+    
+    def process(self, rgb_image):
+        """Detect pose and return it shaped like the legacy solution results"""
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
+        self.timestamp_ms += self.frame_interval_ms
+        result = self.landmarker.detect_for_video(image, self.timestamp_ms)
+        
+        pose_landmarks = None
+        if result.pose_landmarks:
+            pose_landmarks = SimpleNamespace(landmark=result.pose_landmarks[0])
+        return SimpleNamespace(pose_landmarks=pose_landmarks)
+    
+    def close(self):
+        self.landmarker.close()
+
+class PoseExtractor:
+    """
+    Pose inference for one model configuration: Pose creation, input preparation and landmark extraction
+    
+    Holds no video or GUI state, so reference-precompute worker processes
+    build their own from the same settings.
+    """
+    def __init__(self, model_complexity=0, model_asset_path=None, use_gpu=False, inference_size=640):
+        # model_complexity: 0 = lite (fastest), 1 = full, 2 = heavy (most accurate)
+        # model_asset_path: optional PoseLandmarker .task model (e.g. int8-quantized), overrides model_complexity
+        # use_gpu: run the .task model on the GPU delegate when available (falls back to CPU)
+        # inference_size: frames are downscaled so their long side is at most this before
+        # inference (BlazePose works on 256x256 inputs anyway); None keeps full resolution
         self.mp_pose = mp.solutions.pose
-        self.pose = self.mp_pose.Pose(
+        self.model_complexity = model_complexity
+        self.model_asset_path = model_asset_path
+        self.use_gpu = use_gpu
+        self.inference_size = inference_size
+        
+        # Per-thread scratch buffers (e.g. the RGB copy fed to MediaPipe)
+        self._buffers = threading.local()
+    
+    def settings(self):
+        """Constructor arguments, e.g. for building the same extractor in another process"""
+        return {
+            'model_complexity': self.model_complexity,
+            'model_asset_path': self.model_asset_path,
+            'use_gpu': self.use_gpu,
+            'inference_size': self.inference_size
+        }
+    
+    def create_pose(self):
+        """Create a MediaPipe Pose instance for one video stream"""
+        if self.model_asset_path:
+            return TaskPose(self.model_asset_path, use_gpu=self.use_gpu)
+        
+        return self.mp_pose.Pose(
             static_image_mode=False,
-            model_complexity=1,
+            model_complexity=self.model_complexity,
             min_detection_confidence=0.5, 
             min_tracking_confidence=0.5
         )
+    
+    def extract_keypoints(self, image, pose):
+        """
+        Extract pose keypoints from image
+        
+        Returns flattened (x, y) keypoints and a (33, 3) array of
+        x, y, visibility landmarks, or (None, None) if no pose was found.
+        """
+        rgb_image = self._to_rgb(self._downscale(image))
+        
+        # Read-only input lets MediaPipe use the buffer by reference instead of copying it
+        rgb_image.flags.writeable = False
+        results = pose.process(rgb_image)
+        rgb_image.flags.writeable = True
+        
+        keypoints, landmarks = None, None
+        if results.pose_landmarks:
+            # Fill a flat float32 array straight from the protobuf fields
+            lms = results.pose_landmarks.landmark
+            landmarks = np.fromiter(
+                (v for lm in lms for v in (lm.x, lm.y, lm.visibility)),
+                dtype=np.float32, count=len(lms) * 3
+            ).reshape(-1, 3)
+            
+            keypoints = landmarks[:, :2].flatten()
+        
+        return keypoints, landmarks
+    
+    def _downscale(self, image):
+        """
+        Shrink image so its long side is at most inference_size
+        
+        Landmarks are normalized to the input, so they map back to the
+        original image unchanged.
+        """
+        h, w = image.shape[:2]
+        if not self.inference_size or max(h, w) <= self.inference_size:
+            return image
+        
+        scale = self.inference_size / max(h, w)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        small = getattr(self._buffers, 'small', None)
+        if small is None or small.shape[1::-1] != size:
+            small = self._buffers.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        return cv2.resize(image, size, dst=small, interpolation=cv2.INTER_AREA)
+    
+    def _to_rgb(self, image):
+        """Convert BGR image to RGB in a buffer reused across frames"""
+        rgb_image = getattr(self._buffers, 'rgb', None)
+        if rgb_image is None or rgb_image.shape != image.shape:
+            rgb_image = self._buffers.rgb = np.empty_like(image)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb_image)
+    
+    def read_landmarks(self, cap, count=None):
+        """
+        Run pose estimation on the next count frames of cap (all remaining if None)
+        
+        Decoding runs on a reader thread feeding a bounded queue, so it
+        overlaps with inference instead of adding to it. Returns a
+        (frames, 33, 3) array with NaN rows for frames without a pose.
+        """
+        pose = self.create_pose()
+        all_landmarks = []
+        frame_queue = queue.Queue(maxsize=8)
+        stop_event = threading.Event()
+        
+        def read_frames():
+            num_read = 0
+            while not stop_event.is_set():
+                ret, frame = cap.read() if count is None or num_read < count else (False, None)
+                num_read += 1
+                item = frame if ret else None  # None signals end of video
+                while not stop_event.is_set():
+                    try:
+                        frame_queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if item is None:
+                    break
+        
+        reader = threading.Thread(target=read_frames, daemon=True)
+        reader.start()
+        
+        try:
+            while True:
+                frame = frame_queue.get()
+                if frame is None:
+                    break
+                
+                _, landmarks = self.extract_keypoints(frame, pose)
+                if landmarks is None:
+                    landmarks = np.full((33, 3), np.nan, dtype=np.float32)
+                all_landmarks.append(landmarks)
+        finally:
+            stop_event.set()
+            reader.join()
+            pose.close()
+        
+        return np.array(all_landmarks, dtype=np.float32).reshape(-1, 33, 3)
+
+class PoseComparison:
+    # Score colour per integer percentage: red up to 40%, orange up to 70%, green above
+    SCORE_COLORS = [(0, 0, 255)] * 41 + [(0, 165, 255)] * 30 + [(0, 255, 0)] * 30
+    
+    # Skeleton edges as an (E, 2) index array for vectorized drawing, built once per process
+    CONNECTIONS = np.array(sorted(mp.solutions.pose.POSE_CONNECTIONS), dtype=np.int32)
+    # Contiguous start/end index columns so per-frame lookups don't re-slice
+    CONNECTION_STARTS = np.ascontiguousarray(CONNECTIONS[:, 0])
+    CONNECTION_ENDS = np.ascontiguousarray(CONNECTIONS[:, 1])
+    
+    # Fixed-topology scoring: limb vectors = LIMB_MATRIX @ (33, 2) pose, and
+    # LIMB_INCIDENCE maps wrong limbs back to their keypoints
+    LIMB_MATRIX = np.zeros((len(CONNECTIONS), 33), dtype=np.float32)
+    LIMB_MATRIX[np.arange(len(CONNECTIONS)), CONNECTION_STARTS] = -1.0
+    LIMB_MATRIX[np.arange(len(CONNECTIONS)), CONNECTION_ENDS] = 1.0
+    LIMB_INCIDENCE = LIMB_MATRIX != 0
+    
+    # Reference videos shorter than this many frames per worker are precomputed in-process,
+    # since starting a worker (and its MediaPipe graph) takes a second or two
+    PRECOMPUTE_CHUNK_MIN = 300
+    
+    def __init__(self, reference_video_path, model_complexity=0, model_asset_path=None, use_gpu=False,
+                 inference_size=640, precompute_workers=None, cv_threads=1):
+        # Parallelism comes from our own pipeline threads, so keep OpenCV's internal
+        # pool small to avoid oversubscribing cores (cv_threads=0 disables it, -1 restores the default)
+        cv2.setNumThreads(cv_threads)
+        cv2.setUseOptimized(True)
+        
+        # Initialize MediaPipe (see PoseExtractor for the model settings)
+        self.mp_pose = mp.solutions.pose
+        self.extractor = PoseExtractor(model_complexity, model_asset_path, use_gpu, inference_size)
+        # precompute_workers: processes used to precompute reference poses (default: half the cores)
+        self.precompute_workers = precompute_workers or max(1, (os.cpu_count() or 1) // 2)
+        self.user_pose = self.extractor.create_pose()
         self.mp_drawing = mp.solutions.drawing_utils
         
+        # Per-instance scoring scratch buffers
+        self._pose_pair = np.empty((2, 33, 2), dtype=np.float32)
+        self._limb_pair = np.empty((2, len(self.CONNECTIONS), 2), dtype=np.float32)
+        
+        # Side-by-side display canvases (reference left, user right), triple-buffered:
+        # the processing thread draws into a free one while the GUI shows another
+        self.display_canvases = [np.zeros((480, 1280, 3), dtype=np.uint8) for _ in range(3)]
+        self._canvas_lock = threading.Lock()
+        self._latest_canvas = None  # Index of the newest finished canvas, not yet shown
+        self._shown_canvas = None   # Index of the canvas the GUI is showing
+        
         # Load reference video
         self.reference_video_path = reference_video_path
-        self.ref_cap = cv2.VideoCapture(reference_video_path)
-        self.ref_fps = self.ref_cap.get(cv2.CAP_PROP_FPS)
+        self.ref_cap = self._open_reference()
+        self.ref_fps = self.ref_cap.get(cv2.CAP_PROP_FPS) or 30.0  # Some containers report 0
         
         # Get video info
         total_frames = int(self.ref_cap.get(cv2.CAP_PROP_FRAME_COUNT))
         print(f"Reference video: {total_frames} frames, {self.ref_fps} FPS")
         
+        # Reference poses are precomputed once and looked up per frame
+        if self.ref_cap.isOpened():
+            self.ref_landmarks = self._load_reference_landmarks()
+        else:
+            self.ref_landmarks = np.empty((0, 33, 3), dtype=np.float32)
+        
+        # Reference playback clock (frames are picked by elapsed time, not by loop count)
+        self.ref_frame_idx = 0
+        self.ref_start_time = time.monotonic()
+        self._last_reference = (False, None, None, None)
+        self._pause_time = None
+        
+        # A second reference capture opened in the background, used to loop
+        # back to frame 0 without seeking
+        self._ref_opener = ThreadPoolExecutor(max_workers=1)
+        self._spare_ref_cap = None
+        
         # Video recording
         self.video_writer = None
         self.is_recording = False
         self.output_filename = None
+        self.record_queue = None
+        self.record_buffers = None
+        self.encoder_thread = None
+        self._score_tiles = {}  # (score %, correct keypoints) -> rendered overlay tile
+        self._timestamp_tile = None  # (timestamp text, rendered tile)
         
-    def _extract_keypoints(self, image):
-        """Extract pose keypoints from image"""
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = self.pose.process(rgb_image)
+    def _open_reference(self):
+        """Open the reference video, hardware-accelerated if available"""
+        return _open_video(self.reference_video_path)
+    
+    def _load_reference_landmarks(self):
+        """
+        Load reference landmarks from disk, precomputing them if needed
         
-        keypoints = None
-        if results.pose_landmarks:
-            keypoints = []
-            for landmark in results.pose_landmarks.landmark:
-                keypoints.extend([landmark.x, landmark.y])
-            keypoints = np.array(keypoints)
+        The cache is stored next to the video as <video>.<settings>.landmarks.npy
+        with shape (frames, 33, 3) and NaN rows for frames without a pose.
+        The settings tag (model, inference size and, for pooled precomputes, the
+        worker count) keeps caches from different settings apart, and a cache
+        is rebuilt when the video or the .task model is newer than it. Freshly computed landmarks are used as-is, so a cache
+        that can't be written only costs the precompute on the next start.
+        """
+        extractor = self.extractor
+        model_tag = (os.path.splitext(os.path.basename(extractor.model_asset_path))[0]
+                     if extractor.model_asset_path else f"c{extractor.model_complexity}")
+        size_tag = f"s{extractor.inference_size}" if extractor.inference_size else "full"
+        total_frames = int(self.ref_cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        num_workers = min(self.precompute_workers, total_frames // self.PRECOMPUTE_CHUNK_MIN)
+        # Tracking restarts at every chunk boundary, so the worker count is part of the result
+        pool_tag = f"-p{num_workers}" if num_workers > 1 else ""
+        cache_path = f"{self.reference_video_path}.{model_tag}-{size_tag}{pool_tag}.landmarks.npy"
+        
+        sources = [self.reference_video_path]
+        if extractor.model_asset_path:
+            sources.append(extractor.model_asset_path)
+        if (not os.path.exists(cache_path) or
+                os.path.getmtime(cache_path) < max(os.path.getmtime(path) for path in sources)):
+            return self._precompute_reference_landmarks(cache_path, total_frames, num_workers)
+        
+        # Memory-map so only the frames actually played are read
+        return np.load(cache_path, mmap_mode='r')
+    
+    def _precompute_reference_landmarks(self, cache_path, total_frames, num_workers):
+        """
+        Run pose estimation over the whole reference video, save and return it
+        
+        Long videos are split into num_workers contiguous chunks handled by a
+        pool of worker processes, each with its own Pose instance. Tracking and
+        smoothing restart at every chunk, so frames just after a boundary can
+        differ slightly from an in-process run. Workers always run on the CPU
+        so they don't contend for a single GPU. Short videos are processed in
+        this process.
+        """
+        print("Precomputing reference poses...")
+        if num_workers > 1:
+            chunk_size = -(-total_frames // num_workers)
+            starts = range(0, total_frames, chunk_size)
+            # The last chunk reads to the end, since container frame counts can be approximate
+            counts = [chunk_size] * (len(starts) - 1) + [None]
+            # spawn so every worker initializes MediaPipe from scratch
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                chunks = pool.map(_precompute_landmarks_range, repeat(self.reference_video_path),
+                                  starts, counts, repeat({**self.extractor.settings(), 'use_gpu': False}))
+                ref_landmarks = np.concatenate(list(chunks))
+        else:
+            try:
+                ref_landmarks = self.extractor.read_landmarks(self.ref_cap)
+            finally:
+                self.ref_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
         
-        return keypoints, results
+        # Write to a temp file and rename, so an interrupted save never leaves a truncated cache
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, ref_landmarks)
+            os.replace(tmp_path, cache_path)
+            print(f"✅ Reference poses cached: {cache_path} ({len(ref_landmarks)} frames)")
+        except OSError as e:
+            # e.g. a read-only video directory: keep going with the in-memory result
+            print(f"⚠️ Could not cache reference poses: {e}")
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return ref_landmarks
+    
+    def _capture_loop(self, cap, frame_queue, stop_event):
+        """Read frames on a background thread, keeping only the newest ones"""
+        while not stop_event.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                frame_queue.put(None)  # Signal end of stream
+                break
+            
+            # Drop the oldest frame so inference always sees the latest one
+            if frame_queue.full():
+                try:
+                    frame_queue.get_nowait()
+                except queue.Empty:
+                    pass
+            frame_queue.put(frame)
     
-    def _calculate_score(self, pose1, pose2, threshold=0.1):
+    def _restart_reference(self):
+        """
+        Rewind reference video and reset its playback clock
+        
+        Seeking to frame 0 makes FFmpeg re-decode the first GOP and can stall
+        for tens of ms, so a freshly opened spare capture is swapped in when
+        one is ready and the next spare is opened in the background.
+        """
+        spare = self._spare_ref_cap
+        if spare is not None and spare.done():
+            spare_cap = spare.result()
+            if spare_cap.isOpened():
+                old_cap, self.ref_cap = self.ref_cap, spare_cap
+                self._ref_opener.submit(old_cap.release)
+            else:
+                spare_cap.release()
+                self.ref_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            spare = None
+        else:
+            self.ref_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        
+        if spare is None:
+            self._spare_ref_cap = self._ref_opener.submit(self._open_reference)
+        self.ref_frame_idx = 0
+        self.ref_start_time = time.monotonic()
+        if self._pause_time is not None:
+            # Restarted while paused: the clock starts from here once resumed
+            self._pause_time = self.ref_start_time
+    
+    def _read_reference_frame(self):
+        """
+        Read the reference frame matching the current playback time
+        
+        Frames that are already late are skipped with grab(), which does not
+        decode them. Returns None if the reference has not advanced since the
+        last call.
+        """
+        target_idx = int((time.monotonic() - self.ref_start_time) * self.ref_fps)
+        if target_idx < self.ref_frame_idx:
+            return None
+        
+        while self.ref_frame_idx <= target_idx:
+            if not self.ref_cap.grab():
+                # Restart reference video
+                self._restart_reference()
+                if not self.ref_cap.grab():
+                    return False, None
+                self.ref_frame_idx = 1
+                break
+            self.ref_frame_idx += 1
+        
+        return self.ref_cap.retrieve()
+    
+    def _process_reference_frame(self):
+        """Read current reference frame and look up its precomputed pose"""
+        frame = self._read_reference_frame()
+        if frame is None:
+            # Reference has not advanced, reuse the last frame and pose
+            return self._last_reference
+        
+        ret_ref, ref_frame = frame
+        ref_keypoints, ref_landmarks = None, None
+        if ret_ref and self.ref_frame_idx <= len(self.ref_landmarks):
+            landmarks = self.ref_landmarks[self.ref_frame_idx - 1]
+            if not np.isnan(landmarks[0, 0]):
+                ref_landmarks = landmarks
+                ref_keypoints = landmarks[:, :2].flatten()
+        
+        self._last_reference = (ret_ref, ref_frame, ref_keypoints, ref_landmarks)
+        return self._last_reference
+    
+    def _calculate_score(self, pose1, pose2, threshold=0.9):
         """
         Calculate score based on number of correct keypoints
         
         Scoring method:
-        - Count how many keypoints have distance < threshold
+        - Compare the direction of every limb (skeleton connection) using
+          cosine similarity, so body size and position in frame don't matter
+        - A limb is wrong if its cosine similarity < threshold, and both of
+          its keypoints are marked wrong in the returned (33,) boolean mask
         - Score = (correct_keypoints / total_keypoints) * 100%
         
         Threshold guide:
-        - 0.05 = Very strict (small movements matter)
-        - 0.10 = Medium (default, balanced)
-        - 0.15 = Lenient (only major differences matter)
+        - 0.95 = Very strict (small movements matter)
+        - 0.90 = Medium (default, balanced)
+        - 0.80 = Lenient (only major differences matter)
         """
         if pose1 is None or pose2 is None:
-            return 0.0, set()
+            return 0.0, np.zeros(33, dtype=bool)
+        
+        if NUMBA_AVAILABLE:
+            # Single compiled pass, no temporaries (fresh mask: it is queued with recorded frames)
+            wrong_mask = np.zeros(len(pose1) // 2, dtype=bool)
+            num_correct = _limb_score_kernel(pose1, pose2, self.CONNECTIONS, threshold, wrong_mask)
+            return num_correct / len(wrong_mask), wrong_mask
         
-        # Reshape to (33, 2) for 33 keypoints with x,y coordinates
-        pose1_reshaped = pose1.reshape(-1, 2)
-        pose2_reshaped = pose2.reshape(-1, 2)
+        # Both poses as (33, 2) float32 in one preallocated buffer
+        self._pose_pair[0] = pose1.reshape(-1, 2)
+        self._pose_pair[1] = pose2.reshape(-1, 2)
         
-        # Calculate Euclidean distance for each keypoint
-        keypoint_distances = np.linalg.norm(pose1_reshaped - pose2_reshaped, axis=1)
+        # Limb vectors for every connection of both poses in one matmul (translation invariant)
+        np.matmul(self.LIMB_MATRIX, self._pose_pair, out=self._limb_pair)
+        limbs1, limbs2 = self._limb_pair
         
-        # Find correct keypoints (distance <= threshold)
-        correct_keypoints = keypoint_distances <= threshold
+        # Cosine similarity between matching limbs (scale invariant), compared
+        # without dividing: dot < threshold * (|a||b| + eps)
+        dots = np.einsum('ij,ij->i', limbs1, limbs2)
+        squared_norms = np.einsum('kij,kij->ki', self._limb_pair, self._limb_pair)
+        norms = np.sqrt(squared_norms[0] * squared_norms[1])
+        wrong_limbs = dots < threshold * (norms + 1e-10)
         
-        # Find wrong keypoints (distance > threshold)
-        wrong_keypoints = set(np.where(~correct_keypoints)[0].tolist())
+        # Mark wrong keypoints (endpoints of limbs pointing the wrong way)
+        wrong_mask = wrong_limbs @ self.LIMB_INCIDENCE
         
         # Calculate score based on percentage of correct keypoints
-        num_correct = np.sum(correct_keypoints)
-        total_keypoints = len(keypoint_distances)
+        total_keypoints = len(wrong_mask)
+        num_correct = total_keypoints - np.count_nonzero(wrong_mask)
         score = num_correct / total_keypoints  # Returns value between 0 and 1
         
-        return score, wrong_keypoints
+        return score, wrong_mask
     
-    def _draw_pose(self, frame, results, color=(0, 255, 0), wrong_keypoints=None):
-        """Draw pose landmarks on frame with error highlighting"""
-        if results.pose_landmarks:
-            # Draw landmarks with custom color
-            landmarks = results.pose_landmarks.landmark
+    def _draw_pose(self, frame, landmarks, color=(0, 255, 0), wrong_mask=None):
+        """Draw pose landmarks (33 x [x, y, visibility]) on frame with error highlighting"""
+        if landmarks is not None:
             h, w, _ = frame.shape
+            points = (landmarks[:, :2] * (w, h)).astype(np.int32)
+            visible = landmarks[:, 2] > 0.5
             
-            # Draw connections
-            connections = self.mp_pose.POSE_CONNECTIONS
-            for connection in connections:
-                start_idx, end_idx = connection
-                start = landmarks[start_idx]
-                end = landmarks[end_idx]
-                
-                if start.visibility > 0.5 and end.visibility > 0.5:
-                    start_point = (int(start.x * w), int(start.y * h))
-                    end_point = (int(end.x * w), int(end.y * h))
-                    cv2.line(frame, start_point, end_point, color, 2)
+            # Draw all connections with both ends visible in one call
+            edge_visible = visible[self.CONNECTION_STARTS] & visible[self.CONNECTION_ENDS]
+            segments = points[self.CONNECTIONS[edge_visible]]
+            if len(segments):
+                cv2.polylines(frame, list(segments), False, color, 2)
+            
+            # Split visible keypoints into normal and wrong ones
+            wrong = wrong_mask if wrong_mask is not None else np.zeros(len(landmarks), dtype=bool)
+            
+            # Normal keypoints
+            for x, y in points[visible & ~wrong].tolist():
+                cv2.circle(frame, (x, y), 4, color, -1)
             
-            # Draw keypoints
-            for idx, landmark in enumerate(landmarks):
-                if landmark.visibility > 0.5:
-                    x, y = int(landmark.x * w), int(landmark.y * h)
-                    
-                    # Check if this keypoint is wrong
-                    if wrong_keypoints is not None and idx in wrong_keypoints:
-                        # Draw red circle for wrong keypoints
-                        cv2.circle(frame, (x, y), 10, (0, 0, 255), 2)  # Red outer circle
-                        cv2.circle(frame, (x, y), 4, (0, 0, 255), -1)   # Red filled circle
-                    else:
-                        # Normal keypoint
-                        cv2.circle(frame, (x, y), 4, color, -1)
+            # Draw red circles for wrong keypoints
+            for x, y in points[visible & wrong].tolist():
+                cv2.circle(frame, (x, y), 10, (0, 0, 255), 2)  # Red outer circle
+                cv2.circle(frame, (x, y), 4, (0, 0, 255), -1)   # Red filled circle
         
         return frame
     
-    def _create_display(self, ref_frame, ref_results, user_frame, user_results, score, wrong_keypoints):
-        """Create side-by-side display"""
-        # Resize frames
-        height = 480
-        width = 640
+    def _create_display(self, canvas, ref_frame, ref_landmarks, user_frame, user_landmarks, wrong_mask):
+        """
+        Create side-by-side display in a reused canvas
+        
+        Both frames are resized straight into their half of the canvas, so no
+        per-frame buffers are allocated. Returns the canvas and the user half.
+        """
+        height, width = canvas.shape[0], canvas.shape[1] // 2
+        ref_view, user_view = canvas[:, :width], canvas[:, width:]
         
         if ref_frame is not None:
-            ref_display = cv2.resize(ref_frame, (width, height))
-            ref_display = self._draw_pose(ref_display, ref_results, color=(0, 0, 255))  # Red
+            cv2.resize(ref_frame, (width, height), dst=ref_view)
+            self._draw_pose(ref_view, ref_landmarks, color=(0, 0, 255))  # Red
         else:
-            ref_display = np.zeros((height, width, 3), dtype=np.uint8)
-            cv2.putText(ref_display, "No Reference", (width//2-100, height//2), 
+            ref_view[:] = 0
+            cv2.putText(ref_view, "No Reference", (width//2-100, height//2), 
                        cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
         
-        user_display = cv2.resize(user_frame, (width, height))
+        cv2.resize(user_frame, (width, height), dst=user_view)
         # Draw user pose with error highlighting
-        user_display = self._draw_pose(user_display, user_results, color=(0, 255, 0), wrong_keypoints=wrong_keypoints)
+        self._draw_pose(user_view, user_landmarks, color=(0, 255, 0), wrong_mask=wrong_mask)
         
-        # Create combined display
-        combined = np.hstack([ref_display, user_display])
+        return canvas, user_view
+    
+    def _draw_labels(self, combined, score, wrong_mask):
+        """Draw labels and score on the side-by-side display"""
+        height, width = combined.shape[0], combined.shape[1] // 2
         
         # Add labels
         cv2.putText(combined, "Sample Pose", (20, 30), 
@@ -142,8 +633,9 @@ class PoseComparison:
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         
         # Add score
-        score_text = f"Score: {int(score * 100)}%"
-        score_color = (0, 255, 0) if score > 0.7 else (0, 165, 255) if score > 0.4 else (0, 0, 255)
+        score_percent = int(score * 100)
+        score_text = f"Score: {score_percent}%"
+        score_color = self.SCORE_COLORS[score_percent]
         
         # Score text
         cv2.putText(combined, score_text, (width + 20, height - 40), 
@@ -151,26 +643,38 @@ class PoseComparison:
         
         # Add correct/wrong keypoints count
         total_keypoints = 33
-        correct_keypoints = total_keypoints - len(wrong_keypoints)
+        correct_keypoints = total_keypoints - int(np.count_nonzero(wrong_mask))
         count_text = f"Correct: {correct_keypoints}/{total_keypoints}"
         cv2.putText(combined, count_text, (width + 20, height - 80), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        
-        return combined, user_display
     
     def _start_recording(self, width, height, fps=30.0):
         """Start recording video"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         self.output_filename = f"your_pose_{timestamp}.mp4"
         
-        # Define codec and create VideoWriter
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        self.video_writer = cv2.VideoWriter(
-            self.output_filename,
-            fourcc,
-            fps,
-            (width, height)
-        )
+        # Prefer H.264 (multi-threaded encoder); fall back to mp4v on builds without it
+        for codec in ('avc1', 'mp4v'):
+            fourcc = cv2.VideoWriter_fourcc(*codec)
+            self.video_writer = cv2.VideoWriter(
+                self.output_filename,
+                fourcc,
+                fps,
+                (width, height)
+            )
+            if self.video_writer.isOpened():
+                break
+            self.video_writer.release()
+        else:
+            self.video_writer = None
+            print(f"❌ Could not open a video writer for {self.output_filename}")
+            return
+        
+        # Encode on a dedicated thread so codec stalls never block the main loop
+        self.record_queue = queue.Queue(maxsize=4)
+        self.record_buffers = queue.SimpleQueue()  # Free frame buffers returned by the encoder
+        self.encoder_thread = threading.Thread(target=self._encoder_loop, daemon=True)
+        self.encoder_thread.start()
         
         self.is_recording = True
         print(f"✅ Recording started: {self.output_filename}")
@@ -178,47 +682,222 @@ class PoseComparison:
     def _stop_recording(self):
         """Stop recording video"""
         if self.video_writer is not None:
+            self.is_recording = False
+            
+            # Let the encoder flush queued frames before closing the file
+            self.record_queue.put(None)
+            self.encoder_thread.join()
+            self.encoder_thread = None
+            
             self.video_writer.release()
             self.video_writer = None
-            self.is_recording = False
             print(f"✅ Recording saved: {self.output_filename}")
     
-    def _write_frame(self, frame, score, wrong_keypoints):
-        """Write frame to video with score overlay"""
-        if self.is_recording and self.video_writer is not None:
-            # Create a copy to add score overlay
-            frame_with_score = frame.copy()
+    def _encoder_loop(self):
+        """Draw score overlay and encode recorded frames until stopped"""
+        while True:
+            item = self.record_queue.get()
+            if item is None:
+                break
             
-            # Add score
-            score_text = f"Score: {int(score * 100)}%"
-            score_color = (0, 255, 0) if score > 0.7 else (0, 165, 255) if score > 0.4 else (0, 0, 255)
+            frame, score, wrong_mask = item
+            self._draw_score_overlay(frame, score, wrong_mask)
+            self.video_writer.write(frame)
+            self.record_buffers.put(frame)  # Hand the buffer back for reuse
+    
+    def _write_frame(self, frame, score, wrong_mask):
+        """Queue frame for the encoder thread, dropping the oldest one if it falls behind"""
+        if self.is_recording and self.video_writer is not None:
+            # Copy since the display canvas is redrawn every frame, into a
+            # recycled buffer (at most queue size + 2 are ever in flight)
+            try:
+                frame_copy = self.record_buffers.get_nowait()
+            except queue.Empty:
+                frame_copy = np.empty_like(frame)
+            np.copyto(frame_copy, frame)
+            item = (frame_copy, score, wrong_mask)
             
+            try:
+                self.record_queue.put_nowait(item)
+            except queue.Full:
+                try:
+                    dropped = self.record_queue.get_nowait()
+                    if dropped is not None:
+                        self.record_buffers.put(dropped[0])
+                except queue.Empty:
+                    pass
+                self.record_queue.put_nowait(item)
+    
+    def _draw_score_overlay(self, frame_with_score, score, wrong_mask):
+        """
+        Draw score, keypoint count and timestamp on a recorded frame
+        
+        Text is rasterized once into cached tiles (score and count only take
+        a few dozen values, the timestamp changes once a second) and then
+        just masked onto the frame.
+        """
+        # Score and correct/wrong count
+        score_percent = int(score * 100)
+        correct_keypoints = 33 - int(np.count_nonzero(wrong_mask))
+        key = (score_percent, correct_keypoints)
+        tile = self._score_tiles.get(key)
+        if tile is None:
+            tile = self._score_tiles[key] = self._render_score_tile(score_percent, correct_keypoints)
+        self._paste_tile(frame_with_score, tile, 0, 0)
+        
+        # Add timestamp
+        timestamp = time.strftime('%H:%M:%S')
+        if self._timestamp_tile is None or self._timestamp_tile[0] != timestamp:
+            self._timestamp_tile = (timestamp, self._render_tile(
+                lambda image, color: cv2.putText(image, timestamp, (20, 30),
+                                                 cv2.FONT_HERSHEY_SIMPLEX, 0.6, color or (200, 200, 200), 2),
+                (160, 40)
+            ))
+        self._paste_tile(frame_with_score, self._timestamp_tile[1], 0, frame_with_score.shape[0] - 50)
+    
+    def _render_score_tile(self, score_percent, correct_keypoints):
+        """Render the score box and correct-keypoint count for the recording overlay"""
+        score_text = f"Score: {score_percent}%"
+        score_color = self.SCORE_COLORS[score_percent]
+        count_text = f"Correct: {correct_keypoints}/33"
+        (text_width, text_height), _ = cv2.getTextSize(score_text, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 3)
+        
+        def draw(image, color):
             # Score background for better visibility
-            (text_width, text_height), baseline = cv2.getTextSize(
-                score_text, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 3
-            )
-            cv2.rectangle(frame_with_score, (10, 10), 
-                         (text_width + 30, text_height + 30), (0, 0, 0), -1)
-            
-            # Score text
-            cv2.putText(frame_with_score, score_text, (20, text_height + 20), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1.2, score_color, 3)
-            
-            # Add correct/wrong count
-            total_keypoints = 33
-            correct_keypoints = total_keypoints - len(wrong_keypoints)
-            count_text = f"Correct: {correct_keypoints}/{total_keypoints}"
-            
-            cv2.putText(frame_with_score, count_text, (20, text_height + 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            
-            # Add timestamp
-            from datetime import datetime
-            timestamp = datetime.now().strftime('%H:%M:%S')
-            cv2.putText(frame_with_score, timestamp, (20, frame_with_score.shape[0] - 20), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 2)
-            
-            self.video_writer.write(frame_with_score)
+            cv2.rectangle(image, (10, 10), (text_width + 30, text_height + 30), color or (0, 0, 0), -1)
+            cv2.putText(image, score_text, (20, text_height + 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.2, color or score_color, 3)
+            cv2.putText(image, count_text, (20, text_height + 60),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, color or (255, 255, 255), 2)
+        
+        return self._render_tile(draw, (max(text_width + 40, 260), text_height + 75))
+    
+    def _render_tile(self, draw, size):
+        """Run draw(image, color) on a blank (width, height) tile and return it with its coverage mask"""
+        width, height = size
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        draw(image, None)  # Real colours
+        draw(mask, 255)    # Same shapes in white mark the pixels to copy
+        return image, mask
+    
+    def _paste_tile(self, frame, tile, x, y):
+        """Copy the drawn pixels of a tile onto frame at (x, y), clipped to the frame"""
+        image, mask = tile
+        h = min(image.shape[0], frame.shape[0] - y)
+        w = min(image.shape[1], frame.shape[1] - x)
+        if h > 0 and w > 0:
+            cv2.copyTo(image[:h, :w], mask[:h, :w], frame[y:y + h, x:x + w])
+    
+    def _acquire_canvas(self):
+        """Pick a display canvas that is neither waiting to be shown nor being shown"""
+        with self._canvas_lock:
+            for idx in range(len(self.display_canvases)):
+                if idx != self._latest_canvas and idx != self._shown_canvas:
+                    return idx
+    
+    def _publish_canvas(self, idx):
+        """Hand a finished canvas to the GUI thread"""
+        with self._canvas_lock:
+            self._latest_canvas = idx
+    
+    def _take_latest_canvas(self):
+        """Return the newest finished canvas for display, or None if nothing new"""
+        with self._canvas_lock:
+            if self._latest_canvas is None:
+                return None
+            self._shown_canvas = self._latest_canvas
+            self._latest_canvas = None
+            return self.display_canvases[self._shown_canvas]
+    
+    def _handle_control(self, key, paused):
+        """Apply a key press forwarded from the GUI thread, returns new paused state"""
+        if key == ord('r'):
+            # Restart reference video
+            self._restart_reference()
+            print("Reference video restarted")
+        elif key == ord('v'):
+            # Toggle recording
+            if not self.is_recording:
+                # Recording size is the user half of the display
+                height, width = self.display_canvases[0].shape[0], self.display_canvases[0].shape[1] // 2
+                self._start_recording(width, height, fps=30.0)
+            else:
+                self._stop_recording()
+        elif key == ord(' '):
+            paused = not paused
+            # Keep the reference clock from running while paused
+            if paused:
+                self._pause_time = time.monotonic()
+            else:
+                self.ref_start_time += time.monotonic() - self._pause_time
+                self._pause_time = None
+            print(f"{'Paused' if paused else 'Resumed'}")
+        return paused
+    
+    def _processing_loop(self, user_frames, controls, stop_event):
+        """Score and draw frames off the GUI thread until stopped or the camera ends"""
+        paused = False
+        
+        # Decode the reference while the user frame is processed
+        ref_reader = ThreadPoolExecutor(max_workers=1)
+        self._restart_reference()
+        
+        try:
+            while not stop_event.is_set():
+                # Apply controls (block on them while paused instead of spinning)
+                try:
+                    key = controls.get(timeout=0.1) if paused else controls.get_nowait()
+                    paused = self._handle_control(key, paused)
+                    continue
+                except queue.Empty:
+                    if paused:
+                        continue
+                
+                # Read user frame
+                try:
+                    user_frame = user_frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if user_frame is None:
+                    break
+                
+                ref_future = ref_reader.submit(self._process_reference_frame)
+                
+                # Flip for mirror effect
+                user_frame = cv2.flip(user_frame, 1)
+                
+                # Extract poses
+                user_keypoints, user_landmarks = self.extractor.extract_keypoints(user_frame, self.user_pose)
+                ret_ref, ref_frame, ref_keypoints, ref_landmarks = ref_future.result()
+                
+                # Calculate score and find wrong keypoints
+                score, wrong_mask = self._calculate_score(user_keypoints, ref_keypoints)
+                
+                # Create display
+                canvas_idx = self._acquire_canvas()
+                display, user_display = self._create_display(
+                    self.display_canvases[canvas_idx],
+                    ref_frame if ret_ref else None, ref_landmarks, 
+                    user_frame, user_landmarks, wrong_mask
+                )
+                
+                # Write frame if recording (only user pose side, before labels are drawn on it)
+                if self.is_recording:
+                    self._write_frame(user_display, score, wrong_mask)
+                
+                self._draw_labels(display, score, wrong_mask)
+                
+                # Add recording indicator
+                if self.is_recording:
+                    cv2.circle(display, (10, 10), 10, (0, 0, 255), -1)  # Red dot
+                
+                self._publish_canvas(canvas_idx)
+        finally:
+            # Stop recording if still active
+            if self.is_recording:
+                self._stop_recording()
+            ref_reader.shutdown(wait=True)
     
     def run(self, camera_index=0):
         """Run side-by-side comparison"""
@@ -236,84 +915,67 @@ class PoseComparison:
         print("  SPACE - Pause/Resume")
         print("="*50 + "\n")
         
-        paused = False
-        score = 0.0
-        wrong_keypoints = set()
+        # Capture camera frames on their own thread so the loop never waits on the device
+        user_frames = queue.Queue(maxsize=2)
+        stop_event = threading.Event()
+        capture_thread = threading.Thread(
+            target=self._capture_loop,
+            args=(user_cap, user_frames, stop_event),
+            daemon=True
+        )
+        capture_thread.start()
+        
+        # Inference, scoring and drawing run on a worker; this thread only does GUI
+        # (imshow/waitKey must stay on the main thread on some platforms)
+        controls = queue.Queue()
+        processor = ThreadPoolExecutor(max_workers=1)
+        processing = processor.submit(self._processing_loop, user_frames, controls, stop_event)
         
         try:
-            while True:
-                if not paused:
-                    # Read user frame
-                    ret_user, user_frame = user_cap.read()
-                    if not ret_user:
-                        break
-                    
-                    # Flip for mirror effect
-                    user_frame = cv2.flip(user_frame, 1)
-                    
-                    # Read reference frame
-                    ret_ref, ref_frame = self.ref_cap.read()
-                    if not ret_ref:
-                        # Restart reference video
-                        self.ref_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                        ret_ref, ref_frame = self.ref_cap.read()
-                    
-                    # Extract poses
-                    user_keypoints, user_results = self._extract_keypoints(user_frame)
-                    
-                    ref_keypoints, ref_results = None, None
-                    if ret_ref:
-                        ref_keypoints, ref_results = self._extract_keypoints(ref_frame)
-                    
-                    # Calculate score and find wrong keypoints
-                    score, wrong_keypoints = self._calculate_score(user_keypoints, ref_keypoints)
-                
-                # Create display (use current score even if paused)
-                display, user_display = self._create_display(
-                    ref_frame if ret_ref else None, ref_results, 
-                    user_frame, user_results, score, wrong_keypoints
-                )
-                
-                # Add recording indicator
-                if self.is_recording:
-                    cv2.circle(display, (10, 10), 10, (0, 0, 255), -1)  # Red dot
-                
-                # Write frame if recording (only user pose side)
-                if self.is_recording and not paused:
-                    self._write_frame(user_display, score, wrong_keypoints)
-                
+            while not processing.done():
                 # Show display
-                cv2.imshow('Pose Comparison - Reference vs Your Pose', display)
+                display = self._take_latest_canvas()
+                if display is not None:
+                    cv2.imshow('Pose Comparison - Reference vs Your Pose', display)
                 
                 # Handle controls
                 key = cv2.waitKey(1) & 0xFF
                 if key == ord('q'):
                     break
-                elif key == ord('r'):
-                    # Restart reference video
-                    self.ref_cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                    print("Reference video restarted")
-                elif key == ord('v'):
-                    # Toggle recording
-                    if not self.is_recording:
-                        # Get dimensions from user display
-                        height, width = user_display.shape[:2]
-                        self._start_recording(width, height, fps=30.0)
-                    else:
-                        self._stop_recording()
-                elif key == ord(' '):
-                    paused = not paused
-                    print(f"{'Paused' if paused else 'Resumed'}")
+                elif key in (ord('r'), ord('v'), ord(' ')):
+                    controls.put(key)
         
         except KeyboardInterrupt:
             print("\nStopping...")
         finally:
-            # Stop recording if still active
-            if self.is_recording:
-                self._stop_recording()
+            stop_event.set()
+            processor.shutdown(wait=True)
+            capture_thread.join(timeout=1.0)
             user_cap.release()
             self.ref_cap.release()
+            self._ref_opener.shutdown(wait=True)
+            if self._spare_ref_cap is not None:
+                self._spare_ref_cap.result().release()
+                self._spare_ref_cap = None
+            self.user_pose.close()
             cv2.destroyAllWindows()
+        
+        # Surface errors raised on the processing thread
+        processing.result()
+
+def _precompute_landmarks_range(video_path, start, count, pose_settings):
+    """
+    Process-pool worker: reference landmarks for count frames from start (None = to the end)
+    
+    Each worker has its own capture and PoseExtractor (and so its own Pose instance).
+    """
+    extractor = PoseExtractor(**pose_settings)
+    cap = _open_video(video_path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        return extractor.read_landmarks(cap, count)
+    finally:
+        cap.release()
 
 # Usage
 if __name__ == "__main__":